@@ -1,6 +1,16 @@
+import functools
+import time
 from datetime import datetime
-import pytz
-import json
+import orjson
+
+@functools.lru_cache(maxsize=None)
+def _ist():
+    """Load the IST tzinfo on first use."""
+    from zoneinfo import ZoneInfo
+    return ZoneInfo('Asia/Kolkata')
+
+# (epoch second, JSON) of the last call; output only changes once per second
+_last = (None, None)
 
 def get_time():
     """
@@ -8,6 +18,11 @@ def get_time():
     Returns:
         JSON string with formatted datetime (e.g., "2025-04-13 23:30:00+05:30").
     """
-    ist = pytz.timezone('Asia/Kolkata')
-    current_time = datetime.now(ist).strftime('%Y-%m-%d %H:%M:%S%z')
-    return json.dumps({"datetime": current_time})
\ No newline at end of file
+    global _last
+    second = int(time.time())
+    if _last[0] == second:
+        return _last[1]
+    current_time = datetime.fromtimestamp(second, _ist()).strftime('%Y-%m-%d %H:%M:%S%z')
+    result = orjson.dumps({"datetime": current_time}).decode()
+    _last = (second, result)
+    return result
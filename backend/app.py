@@ -1,8 +1,17 @@
-import json
+import asyncio
+import functools
+import msgspec
+import orjson
 import os
-from flask import Flask, request, jsonify
+import threading
+from quart import Quart, Response, request, jsonify
 import db
-import google.generativeai as genai
+from breaker import CircuitBreaker
+from cache import ResponseCache
+import embeddings
+from gemini import get_genai, transient_errors
+from logwriter import LogWriter
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 from dotenv import load_dotenv
 from pathlib import Path
 from agents import get_time  
@@ -10,244 +19,496 @@ from agents import get_time
 env_path = Path(__file__).resolve().parent.parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
-app = Flask(__name__)
+app = Quart(__name__)
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     raise ValueError("GEMINI_API_KEY not found in environment variables")
 
-genai.configure(api_key=GEMINI_API_KEY)
+def _tool(name, description, required=None, optional=None):
+    """Declare a Gemini function whose parameters are all strings."""
+    genai = get_genai()
+    params = {**(required or {}), **(optional or {})}
+    parameters = None
+    if params:
+        parameters = genai.protos.Schema(
+            type_=genai.protos.Type.OBJECT,
+            properties={
+                param: genai.protos.Schema(type_=genai.protos.Type.STRING, description=desc)
+                for param, desc in params.items()
+            },
+            required=list(required or {})
+        )
+    return genai.protos.FunctionDeclaration(name=name, description=description, parameters=parameters)
 
-class StateManager:
-    def __init__(self):
-        """Initialize StateManager with Gemini model."""
+# Everything the model may do while answering: (name, description, required params, optional params)
+_TOOL_SPECS = [
+    ("read_memory", "Read a memory table for the user.",
+     {"table_name": "Memory table name"}, None),
+    ("update_memory", "Create or replace a memory table for the user.",
+     {"table_name": "Memory table name", "data": "JSON string to store"}, None),
+    ("read_mode", "Read the data stored for one of the user's modes.",
+     {"table_name": "Mode name"}, None),
+    ("update_mode", "Create or replace the data for one of the user's modes.",
+     {"table_name": "Mode name", "data": "JSON string to store"}, None),
+    ("create_table", "Create a new database table.",
+     {"table_name": "Table name", "schema": "CREATE TABLE statement"}, None),
+    ("list_tables", "List all database tables.", None, None),
+    ("get_schema", "Get the schema of one table, or of all tables if no name is given.",
+     None, {"table_name": "Table name"}),
+    ("execute_query", "Run a read-only SELECT query.",
+     {"query": "SELECT query string"}, None),
+    ("insert_data", "Insert a row into a table.",
+     {"table_name": "Table name", "data": 'JSON object of {"column": "value"}'}, None),
+    ("update_data", "Update rows in a table.",
+     {"table_name": "Table name",
+      "condition": 'JSON object of {"column": "value"} to match',
+      "data": 'JSON object of {"column": "value"} to set'}, None),
+    ("get_time", "Get the current date and time in IST.", None, None),
+]
+
+@functools.lru_cache(maxsize=None)
+def _get_tools():
+    """Declare the tools as Gemini function calls."""
+    return get_genai().protos.Tool(function_declarations=[_tool(*spec) for spec in _TOOL_SPECS])
+
+# Typed arguments for each tool; missing parameters default to "" as the handlers expect
+TOOL_ARGS = {
+    name: msgspec.defstruct(
+        "".join(word.title() for word in name.split("_")) + "Args",
+        [(param, str, "") for param in {**(required or {}), **(optional or {})}]
+    )
+    for name, _, required, optional in _TOOL_SPECS
+}
+
+def _parse_args(name, args):
+    """Convert a function call's arguments to the tool's struct, raising msgspec.ValidationError if malformed."""
+    return msgspec.convert(dict(args), TOOL_ARGS.get(name, msgspec.Struct))
+
+READ_ONLY_TOOLS = {"read_memory", "read_mode", "list_tables", "get_schema", "execute_query", "get_time"}
+
+# Upper bound on tool-call round trips for a single request
+MAX_TOOL_ROUNDS = 8
+
+# Session history in the prompt: the turns most similar to the request plus the latest ones
+HISTORY_RELEVANT_TURNS = 5
+HISTORY_RECENT_TURNS = 2
+# How far back in the session the relevant turns are searched for
+MAX_HISTORY_TURNS = 200
+# Seconds the startup warm-up call may take before serving starts without it
+GEMINI_WARMUP_TIMEOUT = 5
+# Seconds a request waits for its embedding before going on without the cache and relevant history
+REQUEST_EMBED_TIMEOUT = 3
+
+_model = None
+_model_lock = threading.Lock()
+
+def _get_model():
+    """
+    Build the Gemini model once, on first use; constructing it per request is pure overhead.
+    The lock keeps concurrent first callers from each building their own.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = get_genai().GenerativeModel('gemini-1.5-flash', tools=[_get_tools()])
+    return _model
+
+def list_models():
+    """Print the models available to the configured API key (debug helper)."""
+    try:
+        models = get_genai().list_models()
+        model_names = [m.name for m in models]
+        print(f"Available models: {model_names}")
+    except Exception as list_error:
+        print(f"Failed to list models: {list_error}")
+
+_PROMPT_INSTRUCTIONS = """Use the provided functions to read and update memory and modes, manage database tables, and call agents.
+Think carefully about what data structures you need to fulfill the user's request efficiently.
+Create tables, insert, or update data as needed to best serve the user.
+Be decisive - take action to solve the user's need without excessive questioning. when ask you something and expect you to know chances are they are in the db so run all the queries and find that info from the db and then respond.
+
+Respond naturally as a formal, concise butler. Be proactive - anticipate user needs rather than asking questions. 
+Use your database knowledge to provide personalized service.
+Don't mention technical details about database operations unless specifically relevant to the user.
+Focus on solving the user's request efficiently and completely.
+"""
+
+@functools.lru_cache(maxsize=256)
+def _prompt_prefix(elfrid_prompt, world_model, modes_json, memory_tables_json):
+    """
+    Build the slow-changing head of the prompt.
+    Keyed on the content itself, so any mode or memory update produces a new entry
+    and stale prefixes simply age out of the LRU.
+    """
+    return f"""You are Elfrid, defined by: {elfrid_prompt}.
+User's world model: {world_model}.
+Available modes: {modes_json}.
+Memory tables: {memory_tables_json}.
+"""
+
+gemini_breaker = CircuitBreaker("gemini", fail_max=5, reset_timeout=30)
+
+response_cache = ResponseCache()
+log_writer = LogWriter()
+
+# Batched tool handlers: each takes the user id and a list of argument structs and
+# returns one result per call, using a single query or transaction for all of them
+
+async def _read_memories(user_id, calls):
+    names = [args.table_name for args in calls]
+    stored = await asyncio.to_thread(db.read_memories, user_id, names)
+    return [stored.get(name) or f"No memory stored for {name}" for name in names]
+
+async def _read_modes(user_id, calls):
+    names = [args.table_name for args in calls]
+    stored = await asyncio.to_thread(db.get_modes_data, user_id, names)
+    return [stored.get(name) or f"No data stored for {name} mode" for name in names]
+
+async def _update_memories(user_id, calls):
+    results, rows, written = [], [], []
+    for args in calls:
+        if not args.data:
+            results.append("Data required for update action")
+            continue
         try:
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
-        except Exception as e:
-            try:
-                models = genai.list_models()
-                model_names = [m.name for m in models]
-                print(f"Available models: {model_names}")
-            except Exception as list_error:
-                print(f"Failed to list models: {list_error}")
-            raise RuntimeError(f"Failed to initialize Gemini model: {e}")
-    
-    async def call_gemini(self, prompt):
-        """Call the Gemini API with the given prompt."""
+            db.check_memory_data(args.table_name, args.data)
+        except ValueError as e:
+            results.append(str(e))
+            continue
+        written.append(len(results))
+        rows.append((args.table_name, args.data))
+        results.append(f"Updated {args.table_name} successfully.")
+    if rows:
+        try:
+            await asyncio.to_thread(db.update_memories, user_id, rows)
+        except ValueError as e:
+            # Only the batched calls failed; the rejected ones keep their own reasons
+            for index in written:
+                results[index] = str(e)
+    return results
+
+async def _update_modes(user_id, calls):
+    results, rows, written = [], [], []
+    for args in calls:
+        try:
+            orjson.loads(args.data)
+        except orjson.JSONDecodeError:
+            results.append("Invalid JSON data for mode update")
+            continue
+        written.append(len(results))
+        rows.append((args.table_name, args.data))
+        results.append(f"Updated {args.table_name} mode successfully.")
+    if rows:
+        try:
+            await asyncio.to_thread(db.update_modes, user_id, rows)
+        except ValueError as e:
+            for index in written:
+                results[index] = str(e)
+    return results
+
+# Tool handlers: each takes the user id and the call's argument struct and returns its result
+
+async def _create_table(user_id, args):
+    try:
+        return await asyncio.to_thread(db.create_table, args.table_name, args.schema)
+    except ValueError as e:
+        return str(e)
+
+async def _list_tables(user_id, args):
+    try:
+        return await asyncio.to_thread(db.list_tables)
+    except Exception as e:
+        return str(e)
+
+async def _get_schema(user_id, args):
+    try:
+        if args.table_name:
+            return await asyncio.to_thread(db.get_schema, args.table_name)
+        return await asyncio.to_thread(db.get_schema)
+    except ValueError as e:
+        return str(e)
+
+async def _execute_query(user_id, args):
+    try:
+        return await asyncio.to_thread(db.execute_custom_query, args.query)
+    except ValueError as e:
+        return str(e)
+
+async def _insert_data(user_id, args):
+    try:
+        data_dict = orjson.loads(args.data)
+        return await asyncio.to_thread(db.insert_data, args.table_name, data_dict)
+    except orjson.JSONDecodeError:
+        return "Invalid JSON data for insert"
+    except ValueError as e:
+        return str(e)
+
+async def _update_data(user_id, args):
+    try:
+        condition_dict = orjson.loads(args.condition)
+        data_dict = orjson.loads(args.data)
+        return await asyncio.to_thread(db.update_data, args.table_name, condition_dict, data_dict)
+    except orjson.JSONDecodeError:
+        return "Invalid JSON condition or data for update"
+    except ValueError as e:
+        return str(e)
+
+# Tools whose calls within a model turn are grouped and handled together
+BATCH_HANDLERS = {
+    "read_memory": _read_memories,
+    "read_mode": _read_modes,
+    "update_memory": _update_memories,
+    "update_mode": _update_modes,
+}
+
+ACTION_HANDLERS = {
+    "create_table": _create_table,
+    "list_tables": _list_tables,
+    "get_schema": _get_schema,
+    "execute_query": _execute_query,
+    "insert_data": _insert_data,
+    "update_data": _update_data,
+}
+
+# Agents take no arguments and return in microseconds, so they are called inline when requested
+AGENTS = {"get_time": get_time.get_time}
+
+async def _embed_request(input_text):
+    """Embed the request text, or return None if the embedding call fails or is too slow."""
+    try:
+        return await asyncio.wait_for(embeddings.embed_text(input_text), REQUEST_EMBED_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"Timed out embedding request after {REQUEST_EMBED_TIMEOUT}s")
+        return None
+    except Exception as e:
+        print(f"Error embedding request: {e}")
+        return None
+
+class StateManager:
+    async def call_gemini(self, chat, content, stream=False):
+        """
+        Send content to a Gemini chat session and return the response.
+        Rate-limit and unavailability errors are retried with jittered backoff,
+        and repeated failures open the circuit breaker.
+        """
+        gemini_breaker.before_call()
         try:
-            response = await self.model.generate_content_async(prompt)
-            return response.text
+            async for attempt in AsyncRetrying(
+                wait=wait_random_exponential(multiplier=0.2, max=4),
+                stop=stop_after_attempt(4),
+                retry=retry_if_exception_type(transient_errors()),
+                reraise=True
+            ):
+                with attempt:
+                    response = await chat.send_message_async(content, stream=stream)
         except Exception as e:
+            gemini_breaker.record_failure()
             raise RuntimeError(f"Error calling Gemini API: {e}")
-    
-    async def process_request(self, user_id, input_text):
+        gemini_breaker.record_success()
+        return response
+
+    async def run_action(self, user_id, name, args):
+        """Run a single tool call requested by the LLM and return its result."""
+        if name in AGENTS:
+            return AGENTS[name]()
+        handler = ACTION_HANDLERS.get(name)
+        if handler is None:
+            return f"Unknown action: {name}"
+        return await handler(user_id, args)
+
+    async def run_group(self, user_id, name, calls):
+        """Run several calls to the same tool and return their results in order."""
+        if name in BATCH_HANDLERS:
+            return await BATCH_HANDLERS[name](user_id, calls)
+        if name in READ_ONLY_TOOLS:
+            return await asyncio.gather(*(self.run_action(user_id, name, args) for args in calls))
+        return [await self.run_action(user_id, name, args) for args in calls]
+
+    async def run_actions(self, user_id, function_calls):
         """
-        Process a user request through the enhanced Elfrid pipeline with full DB control.
+        Run the tool calls from one model turn and return their results in order.
+        Consecutive read-only calls are dispatched together, with reads of the same
+        tool folded into one query; writes run in order since later calls may depend
+        on them, and a run of writes to the same tool shares one transaction.
         """
-        db.validate_user(user_id)
-        elfrid_prompt, world_model, modes_array, memory_tables, db_tables, session_id, chat_state = db.get_context(user_id)
-        session_logs = db.get_session_logs(session_id)
-        
-        # Define available database actions
-        db_actions = [
-            "create_table", 
-            "list_tables", 
-            "get_schema",
-            "execute_query", 
-            "insert_data",
-            "update_data"
-        ]
-        
-        # Define available agents
-        available_agents = ["get_time"]
-        
-        # Step 1: Ask LLM for actions with enhanced DB capabilities
-        initial_prompt = f"""You are Elfrid, a butler AI analyzing a request.
-Available modes: {json.dumps(modes_array)}.
-Memory tables: {json.dumps(memory_tables)}.
-Database tables: {json.dumps(db_tables)}.
-Available database actions: {json.dumps(db_actions)}.
-Available agents: {json.dumps(available_agents)}.
-Session history: {json.dumps(session_logs)}.
-Input: {input_text}.
-
-Return a JSON array of actions. Each action is an object:
-1. For memory operations:
-   - Read: {{"action": "read", "type": "memory", "table_name": str}}
-   - Update: {{"action": "update", "type": "memory", "table_name": str, "data": JSON string}}
-
-2. For mode operations:
-   - Read: {{"action": "read", "type": "mode", "table_name": str}}
-   - Update: {{"action": "update", "type": "mode", "table_name": str, "data": JSON string}}
-
-3. For database operations:
-   - Create table: {{"action": "create_table", "table_name": str, "schema": SQL schema string}}
-   - List tables: {{"action": "list_tables"}}
-   - Get schema: {{"action": "get_schema", "table_name": str (optional)}}
-   - Query data: {{"action": "execute_query", "query": SELECT query string}}
-   - Insert data: {{"action": "insert_data", "table_name": str, "data": {{"column": "value"}} dict}}
-   - Update data: {{"action": "update_data", "table_name": str, "condition": {{"column": "value"}}, "data": {{"column": "value"}}}}
-
-4. For agents:
-   - Call agent: {{"action": "call", "type": "agent", "agent_name": str}}
+        calls = []
+        results = [None] * len(function_calls)
+        for index, function_call in enumerate(function_calls):
+            try:
+                args = _parse_args(function_call.name, function_call.args)
+            except msgspec.ValidationError as e:
+                args = None
+                results[index] = f"Invalid arguments for {function_call.name}: {e}"
+            calls.append((function_call.name, args))
+        start = 0
+        while start < len(calls):
+            name = calls[start][0]
+            end = start + 1
+            if name in READ_ONLY_TOOLS:
+                while end < len(calls) and calls[end][0] in READ_ONLY_TOOLS:
+                    end += 1
+            else:
+                while end < len(calls) and calls[end][0] == name:
+                    end += 1
+            
+            groups = {}
+            for index in range(start, end):
+                if calls[index][1] is not None:
+                    groups.setdefault(calls[index][0], []).append(index)
+            outputs = await asyncio.gather(*(
+                self.run_group(user_id, group_name, [calls[index][1] for index in indices])
+                for group_name, indices in groups.items()
+            ))
+            for indices, group_results in zip(groups.values(), outputs):
+                for index, result in zip(indices, group_results):
+                    results[index] = result
+            start = end
+        return results
 
-Think carefully about what data structures you need to fulfill the user's request efficiently.
-Create tables, insert, or update data as needed to best serve the user.
-Be decisive - take action to solve the user's need without excessive questioning. when ask you something and expect you to know chances are they are in the db so run all the queries and find that info from the db and then respond, 
-Return [] if no actions needed.
-"""
-        
-        actions_response = await self.call_gemini(initial_prompt)
-        
+    async def process_request(self, user_id, input_text):
+        """Process a user request and return the complete reply."""
+        return "".join([chunk async for chunk in self.stream_request(user_id, input_text)])
+
+    async def stream_request(self, user_id, input_text):
+        """
+        Process a user request through the enhanced Elfrid pipeline with full DB control,
+        yielding the reply text as Gemini generates it.
+        The model requests database actions and agents as function calls within a
+        single chat, and answers once it has everything it needs.
+        """
+        # The request embedding serves the cache and the history lookup; compute it while the context loads
+        embedding_task = asyncio.create_task(_embed_request(input_text))
         try:
-            cleaned_response = actions_response.strip()
-            if '```' in cleaned_response:
-                code_block = cleaned_response.split('```')[1]
-                if code_block.startswith('json'):
-                    cleaned_response = code_block[4:].strip()
-                else:
-                    cleaned_response = code_block.strip()
-            
-            actions = json.loads(cleaned_response)
-            if not isinstance(actions, list):
-                raise ValueError("LLM response must be a JSON array")
-        except (json.JSONDecodeError, ValueError) as e:
-            print(f"Error: Invalid LLM actions response: {actions_response}")
-            raise ValueError(f"LLM actions response must be valid JSON array: {e}")
+            context = await asyncio.to_thread(db.get_context, user_id)
+        except BaseException:
+            embedding_task.cancel()
+            raise
+        elfrid_prompt, world_model, modes_json, memory_tables_json, db_tables, session_id, chat_state, has_history = context
         
-        # Step 2: Process actions
-        context = {}
-        for action in actions:
-            action_type = action.get("action")
-            table_type = action.get("type", "")
-            table_name = action.get("table_name", "")
-            agent_name = action.get("agent_name", "")
-            data = action.get("data", "")
-            
-            # Process original memory/mode actions
-            if action_type == "read" and table_type in ["memory", "mode"]:
-                if table_type == "memory":
-                    result = db.execute_query(user_id, "read", table_name)
-                    if result:
-                        context[f"memory_{table_name}"] = result
-                elif table_type == "mode":
-                    conn = db.get_db()
-                    cursor = conn.cursor()
-                    cursor.execute(
-                        "SELECT mode_data FROM modes WHERE user_id = ? AND mode_name = ?",
-                        (user_id, table_name)
-                    )
-                    row = cursor.fetchone()
-                    db.close_db(conn)
-                    if row:
-                        context[f"mode_{table_name}"] = row["mode_data"]
-            
-            elif action_type == "update" and table_type in ["memory", "mode"]:
-                if table_type == "memory":
-                    try:
-                        db.execute_query(user_id, "update", table_name, data)
-                        context[f"update_memory_{table_name}"] = f"Updated {table_name} successfully."
-                    except ValueError as e:
-                        context[f"update_memory_{table_name}"] = str(e)
-                elif table_type == "mode":
-                    try:
-                        json.loads(data)
-                        db.update_mode(user_id, table_name, data)
-                        context[f"update_mode_{table_name}"] = f"Updated {table_name} mode successfully."
-                    except json.JSONDecodeError:
-                        context[f"update_mode_{table_name}"] = "Invalid JSON data for mode update"
-            
-            # Process new database control actions
-            elif action_type == "create_table":
-                try:
-                    schema = action.get("schema")
-                    result = db.create_table(table_name, schema)
-                    context[f"create_table_{table_name}"] = result
-                except ValueError as e:
-                    context[f"create_table_{table_name}"] = str(e)
-            
-            elif action_type == "list_tables":
-                try:
-                    tables = db.list_tables()
-                    context["list_tables"] = tables
-                except Exception as e:
-                    context["list_tables"] = str(e)
-            
-            elif action_type == "get_schema":
-                try:
-                    if table_name:
-                        schema = db.get_schema(table_name)
-                        context[f"schema_{table_name}"] = schema
-                    else:
-                        schemas = db.get_schema()
-                        context["all_schemas"] = schemas
-                except ValueError as e:
-                    context[f"schema_error"] = str(e)
-            
-            elif action_type == "execute_query":
-                try:
-                    query = action.get("query")
-                    results = db.execute_custom_query(query)
-                    context["query_results"] = results
-                except ValueError as e:
-                    context["query_error"] = str(e)
-            
-            elif action_type == "insert_data":
-                try:
-                    data_dict = action.get("data")
-                    result = db.insert_data(table_name, data_dict)
-                    context[f"insert_{table_name}"] = result
-                except ValueError as e:
-                    context[f"insert_error_{table_name}"] = str(e)
-            
-            elif action_type == "update_data":
-                try:
-                    condition_dict = action.get("condition")
-                    data_dict = action.get("data")
-                    result = db.update_data(table_name, condition_dict, data_dict)
-                    context[f"update_{table_name}"] = result
-                except ValueError as e:
-                    context[f"update_error_{table_name}"] = str(e)
-            
-            elif action_type == "call" and table_type == "agent":
-                if agent_name == "get_time":
-                    result = get_time.get_time()
-                    context[f"agent_{agent_name}"] = result
-                else:
-                    context[f"agent_{agent_name}"] = f"Unknown agent: {agent_name}"
+        # A reply is only replayed into the context it was generated for, and never for
+        # a turn that may refer back to earlier turns of its session
+        cacheable = not has_history
+        if cacheable:
+            context_key = response_cache.context_key(world_model, modes_json, memory_tables_json, db_tables, chat_state)
+            cached_response = await response_cache.lookup(user_id, context_key, input_text, embedding_task)
+            if cached_response is not None:
+                embedding_task.cancel()
+                yield cached_response
+                await log_writer.submit(user_id, session_id, input_text, cached_response)
+                return
+        input_embedding = await embedding_task
         
-        # Get updated list of tables after any changes
-        updated_tables = db.list_tables()
+        if input_embedding is not None:
+            session_logs = await asyncio.to_thread(
+                db.get_relevant_logs,
+                session_id,
+                embeddings.to_blob(input_embedding, db.LOG_EMBEDDING_DTYPE),
+                HISTORY_RELEVANT_TURNS,
+                HISTORY_RECENT_TURNS,
+                MAX_HISTORY_TURNS
+            )
+        else:
+            session_logs = await asyncio.to_thread(
+                db.get_session_logs, session_id, HISTORY_RELEVANT_TURNS + HISTORY_RECENT_TURNS
+            )
         
-        # Step 3: Generate final response
-        final_prompt = f"""You are Elfrid, defined by: {elfrid_prompt}.
-User's world model: {world_model}.
-Available modes: {json.dumps(modes_array)}.
-Memory tables: {json.dumps(memory_tables)}.
-Database tables: {json.dumps(updated_tables)}.
+        prefix = _prompt_prefix(elfrid_prompt, world_model, modes_json, memory_tables_json)
+        prompt = f"""{prefix}Database tables: {orjson.dumps(db_tables).decode()}.
 Current session state: {chat_state}.
-Session history: {json.dumps(session_logs)}.
-Additional context from actions: {json.dumps(context)}.
+Session history: {orjson.dumps(session_logs).decode()}.
 User request: {input_text}
 
-Respond naturally as a formal, concise butler. Be proactive - anticipate user needs rather than asking questions. 
-Use your database knowledge to provide personalized service.
-Don't mention technical details about database operations unless specifically relevant to the user.
-Focus on solving the user's request efficiently and completely.
-"""
+{_PROMPT_INSTRUCTIONS}"""
         
-        final_response = await self.call_gemini(final_prompt)
+        chat = _get_model().start_chat()
+        content = prompt
+        reply_chunks = []
+        tool_rounds = 0
+        while True:
+            response = await self.call_gemini(chat, content, stream=True)
+            function_calls = []
+            async for chunk in response:
+                for part in chunk.parts:
+                    if part.function_call:
+                        function_calls.append(part.function_call)
+                    elif part.text:
+                        reply_chunks.append(part.text)
+                        yield part.text
+            if not function_calls:
+                break
+            if tool_rounds == MAX_TOOL_ROUNDS:
+                raise RuntimeError("Gemini did not produce a response within the tool call limit")
+            tool_rounds += 1
+            results = await self.run_actions(user_id, function_calls)
+            protos = get_genai().protos
+            content = [
+                protos.Part(function_response=protos.FunctionResponse(
+                    name=function_call.name, response={"result": result}
+                ))
+                for function_call, result in zip(function_calls, results)
+            ]
         
-        # Step 4: Log interaction
-        db.log_interaction(user_id, session_id, input_text, final_response)
+        final_response = "".join(reply_chunks)
         
-        return final_response
+        # Only replies that touched no tools are safe to replay
+        if cacheable and tool_rounds == 0:
+            response_cache.store(user_id, context_key, input_text, input_embedding, final_response)
+        
+        # Log interaction off the response path
+        await log_writer.submit(user_id, session_id, input_text, final_response)
+
+state_manager = StateManager()
+
+def _sse_event(text, event=None):
+    """Format text as a Server-Sent Events message."""
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in text.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+async def _stream_events(first_chunk, chunks):
+    """Relay reply chunks to the client as Server-Sent Events."""
+    yield _sse_event(first_chunk)
+    try:
+        async for chunk in chunks:
+            yield _sse_event(chunk)
+        yield _sse_event("", "done")
+    except Exception as e:
+        print(f"Error streaming response: {e}")
+        yield _sse_event(str(e), "error")
+
+@app.before_serving
+async def warm_gemini():
+    """
+    Open the Gemini channel before the first request arrives.
+    The SDK creates its async gRPC client lazily and reuses it for the life of the
+    process, so one cheap call here moves the TLS and HTTP/2 setup off the request path
+    and binds the client to the serving event loop.
+    This runs inside Hypercorn's startup, so it gives up after GEMINI_WARMUP_TIMEOUT
+    seconds rather than holding the server back when Gemini is slow or unreachable.
+    """
+    try:
+        await asyncio.wait_for(_get_model().count_tokens_async("ping"), GEMINI_WARMUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"Gemini connection warm-up timed out after {GEMINI_WARMUP_TIMEOUT}s")
+    except Exception as e:
+        print(f"Error warming Gemini connection: {e}")
 
-# Flask routes
+@app.after_serving
+async def flush_logs():
+    """Write out any queued interaction logs before shutting down."""
+    await log_writer.flush()
+
+# Routes
 @app.route('/voice', methods=['POST'])
 async def voice():
-    """Process user voice input."""
-    data = request.json
+    """
+    Process user voice input.
+    Clients that accept text/event-stream receive the reply as it is generated;
+    others get the complete reply as JSON.
+    """
+    data = await request.get_json()
     
     if not data or "user_id" not in data or "input" not in data:
         return jsonify({"error": "Missing user_id or input"}), 400
@@ -256,9 +517,17 @@ async def voice():
     input_text = data["input"]
     
     try:
-        state_manager = StateManager()
-        response = await state_manager.process_request(user_id, input_text)
-        return jsonify({"response": response})
+        if "text/event-stream" not in request.headers.get("Accept", ""):
+            response = await state_manager.process_request(user_id, input_text)
+            return jsonify({"response": response})
+        
+        chunks = state_manager.stream_request(user_id, input_text)
+        # Pull the first chunk here so request errors still map to status codes
+        first_chunk = await anext(chunks, "")
+        response = Response(_stream_events(first_chunk, chunks), mimetype='text/event-stream')
+        # Generation can outlast Quart's default body timeout
+        response.timeout = None
+        return response
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except Exception as e:
@@ -266,9 +535,9 @@ async def voice():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/new_chat', methods=['POST'])
-def new_chat():
+async def new_chat():
     """Create a new chat session."""
-    data = request.json
+    data = await request.get_json()
     
     if not data or "user_id" not in data:
         return jsonify({"error": "Missing user_id"}), 400
@@ -276,7 +545,7 @@ def new_chat():
     user_id = data["user_id"]
     
     try:
-        session_id = db.new_session(user_id)
+        session_id = await asyncio.to_thread(db.new_session, user_id)
         return jsonify({"session_id": session_id})
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
@@ -285,20 +554,33 @@ def new_chat():
         return jsonify({"error": "Internal server error"}), 500
 
 @app.route('/health', methods=['GET'])
-def health_check():
+async def health_check():
     """Simple health check endpoint."""
-    return jsonify({"status": "ok"}), 200
+    return jsonify({
+        "status": "ok",
+        "gemini": gemini_breaker.state,
+        "gemini_breaker_transitions": gemini_breaker.transitions,
+    }), 200
 
 if __name__ == '__main__':
+    import sys
+    if "--list-models" in sys.argv:
+        list_models()
+        sys.exit(0)
+    
     db.init_db()
     
-    import asyncio
-    from asgiref.wsgi import WsgiToAsgi
     from hypercorn.asyncio import serve
     from hypercorn.config import Config
     
-    asgi_app = WsgiToAsgi(app)
     config = Config()
     config.bind = ["localhost:5000"]
     
-    asyncio.run(serve(asgi_app, config))
+    # uvloop is optional; the server runs on the default asyncio loop without it
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    
+    asyncio.run(serve(app, config))
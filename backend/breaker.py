@@ -0,0 +1,57 @@
+import time
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for reset_timeout seconds once fail_max
+    consecutive calls have failed, then lets a single trial call through.
+    While closed it only counts failures, so it costs nothing on the happy path.
+    """
+
+    def __init__(self, name, fail_max=5, reset_timeout=30):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.transitions = 0
+        self._failures = 0
+        self._opened_at = 0.0
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError if calls are currently being short-circuited.
+        While half-open only the trial call gets through; if it never reports back
+        (e.g. it was cancelled), another trial is allowed after reset_timeout.
+        """
+        if self.state == "closed":
+            return
+        now = time.monotonic()
+        if now - self._opened_at < self.reset_timeout:
+            raise CircuitOpenError(f"{self.name} is unavailable, retrying in at most {self.reset_timeout}s")
+        # This caller is the trial; everyone else waits for its result
+        self._opened_at = now
+        if self.state != "half-open":
+            self._set_state("half-open")
+
+    def record_success(self):
+        """Reset the failure count after a successful call."""
+        self._failures = 0
+        if self.state != "closed":
+            self._set_state("closed")
+
+    def record_failure(self):
+        """Count a failed call, opening the circuit when the limit is reached."""
+        self._failures += 1
+        if self.state == "half-open" or self._failures >= self.fail_max:
+            self._opened_at = time.monotonic()
+            # Calls already in flight when it opened may still report failures
+            if self.state != "open":
+                self._set_state("open")
+
+    def _set_state(self, state):
+        """Switch state and report the transition."""
+        print(f"Circuit breaker '{self.name}': {self.state} -> {state}")
+        self.state = state
+        self.transitions += 1
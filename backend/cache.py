@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import orjson
+import db
+import embeddings
+
+class ResponseCache:
+    """
+    Cache of final replies in front of Gemini, keyed per user and per context on the
+    request text. The context key digests everything else the prompt is built from,
+    so a reply is only reused while the user's world model, modes, memory tables and
+    database tables are what they were when it was generated.
+    Exact repeats are answered from an in-memory LRU without any network call;
+    otherwise the request embedding is compared against the cached requests with the
+    same user and context, and a reply is reused when the cosine similarity clears the
+    threshold. New entries live only in memory; once one has been served promote_hits
+    times it is persisted through the db module, so warm restarts keep the replies that
+    actually get reused without writing every one-off.
+    """
+
+    def __init__(self, max_entries=512, threshold=0.95, promote_hits=2):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.promote_hits = promote_hits
+        self._responses = OrderedDict()  # key -> (user_id, context_key, input_text, embedding, response)
+        self._vectors = {}  # (user_id, context_key) -> (keys, matrix of unit embeddings)
+        self._hits = {}  # key -> times served, for entries not persisted yet
+        self._persist_tasks = set()
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+
+    @staticmethod
+    def context_key(*parts):
+        """Digest the non-request parts of a prompt into the key that scopes cache entries."""
+        return hashlib.blake2b(orjson.dumps(parts), digest_size=16).digest()
+
+    @staticmethod
+    def make_key(user_id, context_key, input_text):
+        """Hash a normalized request into the exact-match cache key."""
+        normalized = " ".join(input_text.lower().split())
+        return hashlib.blake2b(f"{user_id}\x00{normalized}".encode(), digest_size=16, key=context_key).digest()
+
+    async def lookup(self, user_id, context_key, input_text, embedding):
+        """
+        Find a cached reply for the request, or return None on a miss.
+        embedding is an awaitable for the request embedding (None if it could not be
+        computed); it is only awaited when there is no exact match.
+        """
+        await self._ensure_loaded()
+
+        key = self.make_key(user_id, context_key, input_text)
+        if key in self._responses:
+            return self._hit(key)
+
+        embedding = await embedding
+        keys, matrix = self._vectors.get((user_id, context_key), ([], None))
+        if embedding is not None and keys:
+            similarities = matrix @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                return self._hit(keys[best])
+
+        return None
+
+    def store(self, user_id, context_key, input_text, embedding, response):
+        """Cache a reply in memory; it is persisted once it proves popular."""
+        key = self.make_key(user_id, context_key, input_text)
+        self._add(key, user_id, context_key, input_text, embedding, response)
+        self._hits[key] = 0
+
+    def _hit(self, key):
+        """Record a cache hit and return the entry's reply, promoting it when due."""
+        self._responses.move_to_end(key)
+        if key in self._hits:
+            self._hits[key] += 1
+            if self._hits[key] >= self.promote_hits:
+                del self._hits[key]
+                task = asyncio.create_task(self._persist(key, *self._responses[key]))
+                self._persist_tasks.add(task)
+                task.add_done_callback(self._persist_tasks.discard)
+        return self._responses[key][4]
+
+    async def _persist(self, key, user_id, context_key, input_text, embedding, response):
+        """Write an entry to SQLite."""
+        blob = embeddings.to_blob(embedding) if embedding is not None else None
+        try:
+            await asyncio.to_thread(db.save_cached_response, key, user_id, context_key, input_text, blob, response)
+        except Exception as e:
+            print(f"Error persisting cached response: {e}")
+
+    async def _ensure_loaded(self):
+        """Warm the in-memory cache from SQLite on first use."""
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            rows = await asyncio.to_thread(db.load_cached_responses, self.max_entries)
+            for key, user_id, context_key, input_text, blob, response in rows:
+                embedding = embeddings.from_blob(blob) if blob is not None else None
+                self._add(key, user_id, context_key, input_text, embedding, response)
+            self._loaded = True
+
+    def _add(self, key, user_id, context_key, input_text, embedding, response):
+        """Insert an entry, evicting the least recently used one when full."""
+        if key in self._responses:
+            self._remove(key)
+        self._responses[key] = (user_id, context_key, input_text, embedding, response)
+        if embedding is not None:
+            scope = (user_id, context_key)
+            keys, matrix = self._vectors.get(scope, ([], None))
+            row = embedding[np.newaxis, :]
+            self._vectors[scope] = (keys + [key], row if matrix is None else np.vstack([matrix, row]))
+        while len(self._responses) > self.max_entries:
+            self._remove(next(iter(self._responses)))
+
+    def _remove(self, key):
+        """Drop an entry from both indexes."""
+        user_id, context_key = self._responses.pop(key)[:2]
+        self._hits.pop(key, None)
+        scope = (user_id, context_key)
+        keys, matrix = self._vectors.get(scope, ([], None))
+        if key in keys:
+            index = keys.index(key)
+            keys = keys[:index] + keys[index + 1:]
+            if keys:
+                self._vectors[scope] = (keys, np.delete(matrix, index, axis=0))
+            else:
+                del self._vectors[scope]
@@ -1,12 +1,232 @@
-import json
+import atexit
+import functools
+import orjson
+import queue
+import re
 import sqlite3
-from datetime import datetime
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+DB_PATH = 'backend/elfrid.db'
+POOL_SIZE = 8
+
+# Table and column names the LLM may use in generated SQL
+_VALID_IDENT = re.compile(r"\A[A-Za-z0-9_]+\Z").fullmatch
+
+# Queries execute_custom_query accepts
+_SELECT_RE = re.compile(r"\s*select\b", re.IGNORECASE)
+
+# SQL run on every request, kept as constants so each call hands sqlite3 the same
+# text and hits the connection's prepared-statement cache
+
+# Every row is tagged with the part of the context it belongs to; the session row
+# also says whether the session has any logged turns yet
+_SQL_CONTEXT = """
+    SELECT 'user' AS kind, world_model AS v1, modes_json AS v2, memory_tables_json AS v3 FROM users WHERE user_id = ?
+    UNION ALL
+    SELECT 'session', session_id, chat_state, EXISTS (SELECT 1 FROM logs WHERE logs.session_id = latest.session_id) FROM (
+        SELECT session_id, chat_state FROM sessions WHERE user_id = ? ORDER BY session_id DESC LIMIT 1
+    ) AS latest
+"""
+_SQL_INSERT_SESSION = "INSERT INTO sessions (user_id, chat_state) VALUES (?, ?) RETURNING session_id"
+_SQL_SESSION_LOGS = """
+    SELECT request, response FROM (
+        SELECT log_id, request, response FROM logs WHERE session_id = ?
+        ORDER BY log_id DESC LIMIT ?
+    ) ORDER BY log_id
+"""
+_SQL_RELEVANT_LOGS = """
+    SELECT log_id, request, response FROM (
+        SELECT log_id, request, response, embedding FROM logs WHERE session_id = ?
+        ORDER BY log_id DESC LIMIT ?
+    )
+    ORDER BY vector_cosine(embedding, ?) DESC LIMIT ?
+"""
+_SQL_RECENT_LOGS = "SELECT log_id, request, response FROM logs WHERE session_id = ? ORDER BY log_id DESC LIMIT ?"
+_SQL_INSERT_LOGS = "INSERT INTO logs (user_id, session_id, request, response, embedding) VALUES (?, ?, ?, ?, ?) RETURNING log_id"
+_SQL_SET_LOG_EMBEDDING = "UPDATE logs SET embedding = ? WHERE log_id = ?"
+_SQL_UPSERT_MEMORY = """
+    INSERT INTO memory (user_id, table_name, data) VALUES (?, ?, ?)
+    ON CONFLICT (user_id, table_name) DO UPDATE SET data = excluded.data, last_updated = CURRENT_TIMESTAMP
+"""
+_SQL_UPSERT_MODE = """
+    INSERT INTO modes (user_id, mode_name, mode_data) VALUES (?, ?, ?)
+    ON CONFLICT (user_id, mode_name) DO UPDATE SET mode_data = excluded.mode_data, last_updated = CURRENT_TIMESTAMP
+"""
+# {} is filled with the IN list's placeholders by _in_list_sql
+_SQL_READ_MEMORIES = "SELECT table_name, data FROM memory WHERE user_id = ? AND table_name IN ({})"
+_SQL_READ_MODES = "SELECT mode_name, mode_data FROM modes WHERE user_id = ? AND mode_name IN ({})"
+_SQL_ELFRID_PROMPT = "SELECT elfrid_prompt FROM config LIMIT 1"
+_SQL_TABLE_SCHEMAS = "SELECT name, sql FROM sqlite_master WHERE type = 'table'"
+_SQL_SAVE_CACHED_RESPONSE = """
+    INSERT OR REPLACE INTO response_cache (cache_key, user_id, context_key, input, embedding, response)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+_SQL_LOAD_CACHED_RESPONSES = """
+    SELECT cache_key, user_id, context_key, input, embedding, response FROM response_cache
+    ORDER BY created_at DESC, rowid DESC LIMIT ?
+"""
+
+# Storage type of log embeddings; half precision halves the blob size
+LOG_EMBEDDING_DTYPE = np.float16
+
+def _vector_cosine(a, b):
+    """SQL function: cosine similarity of two unit-length embeddings stored as float16 blobs."""
+    if a is None or b is None:
+        return None
+    return float(np.dot(
+        np.frombuffer(a, dtype=LOG_EMBEDDING_DTYPE).astype(np.float32),
+        np.frombuffer(b, dtype=LOG_EMBEDDING_DTYPE).astype(np.float32)
+    ))
+
+# Applied once per pooled connection, as a single script
+_PRAGMAS = """
+    PRAGMA journal_mode = WAL;
+    PRAGMA synchronous = NORMAL;
+    PRAGMA foreign_keys = ON;
+    PRAGMA cache_size = -64000;
+    PRAGMA temp_store = MEMORY;
+    PRAGMA mmap_size = 268435456;
+    PRAGMA journal_size_limit = 67108864;
+"""
+
+class ConnectionPool:
+    """Fixed-size pool of long-lived SQLite connections shared across threads."""
+
+    def __init__(self, path, size):
+        self._path = path
+        self._size = size
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """
+        Open a connection and apply the per-connection PRAGMAs once.
+        isolation_level=None leaves transactions to this module: reads run in autocommit,
+        single-statement writes commit themselves, and multi-statement writes BEGIN explicitly.
+        """
+        conn = sqlite3.connect(self._path, check_same_thread=False, cached_statements=512, isolation_level=None)
+        try:
+            conn.row_factory = sqlite3.Row
+            conn.executescript(_PRAGMAS)
+            conn.create_function('vector_cosine', 2, _vector_cosine, deterministic=True)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    @contextmanager
+    def acquire(self):
+        """Borrow a connection, opening a new one while the pool is below its size."""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._created < self._size
+                if can_open:
+                    self._created += 1
+            if not can_open:
+                conn = self._idle.get()
+            else:
+                try:
+                    conn = self._connect()
+                except BaseException:
+                    # Give the slot back, or failed opens would leave callers waiting on connections that never exist
+                    with self._lock:
+                        self._created -= 1
+                    raise
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        """Close every idle connection; the last one to close checkpoints the WAL."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+_pool = ConnectionPool(DB_PATH, POOL_SIZE)
+atexit.register(_pool.close)
+
+def acquire():
+    """
+    Borrow a pooled connection to 'elfrid.db'.
+    Usage:
+        with db.acquire() as conn:
+            conn.execute(...)
+    """
+    return _pool.acquire()
+
+@contextmanager
+def transaction():
+    """
+    Borrow a pooled connection inside one write transaction, committed on exit and
+    rolled back on error. Pass it as conn= to the write helpers to share one commit:
+        with db.transaction() as conn:
+            db.update_mode(user_id, name, data, conn=conn)
+            db.log_interaction(user_id, session_id, request, response, conn=conn)
+    BEGIN IMMEDIATE takes the write lock up front, so keep the block to the writes
+    themselves rather than holding it across a model call.
+    """
+    with acquire() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+@contextmanager
+def _writing(conn=None):
+    """Use the caller's transaction if given, otherwise a pooled connection committed on exit."""
+    if conn is not None:
+        yield conn
+        return
+    with acquire() as own:
+        own.execute('BEGIN')
+        yield own
+        own.commit()
+
+# The config prompt only changes when init_db writes it, so it is read once and kept
+_elfrid_prompt = None
+
+# {table_name: sql} for every table, cached until DDL runs through this module
+_schema_cache = None
+_schema_lock = threading.Lock()
 
 def init_db():
     """Initialize the SQLite database 'elfrid.db' with required tables and default config."""
-    conn = sqlite3.connect('backend/elfrid.db')
+    global _elfrid_prompt
+    with acquire() as conn:
+        _create_schema(conn)
+    _elfrid_prompt = None
+    _invalidate_schema()
+    _load_schema()
+
+def _get_elfrid_prompt(cursor):
+    """Return the Elfrid prompt from config, querying it only on first use."""
+    global _elfrid_prompt
+    if _elfrid_prompt is None:
+        cursor.execute(_SQL_ELFRID_PROMPT)
+        row = cursor.fetchone()
+        _elfrid_prompt = row[0] if row else None
+    return _elfrid_prompt
+
+def _create_schema(conn):
+    """Create the required tables and default config on a connection, in one transaction."""
     cursor = conn.cursor()
-    cursor.execute('PRAGMA foreign_keys = ON')
+    cursor.execute('BEGIN')
 
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS config (
@@ -64,11 +284,42 @@ def init_db():
             request TEXT NOT NULL,
             response TEXT,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            embedding BLOB,
             FOREIGN KEY (user_id) REFERENCES users(user_id),
             FOREIGN KEY (session_id) REFERENCES sessions(session_id)
         )
     ''')
 
+    if 'embedding' not in {row[1] for row in cursor.execute("PRAGMA table_info(logs)")}:
+        cursor.execute('ALTER TABLE logs ADD COLUMN embedding BLOB')
+
+    # Indexes for the per-request lookups. Sessions and logs are ordered by their ids, which
+    # the implicit rowid at the end of idx_logs_session and idx_sessions_user already sorts
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_session ON logs(session_id)')
+
+    # One row per user and name. Older databases may hold duplicates; keep the first row,
+    # which is the one reads have always returned
+    cursor.execute('DELETE FROM memory WHERE memory_id NOT IN (SELECT MIN(memory_id) FROM memory GROUP BY user_id, table_name)')
+    cursor.execute('DELETE FROM modes WHERE mode_id NOT IN (SELECT MIN(mode_id) FROM modes GROUP BY user_id, mode_name)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_memory_user_table ON memory(user_id, table_name)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_modes_user_name ON modes(user_id, mode_name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)')
+
+    _create_user_json_columns(cursor)
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS response_cache (
+            cache_key BLOB PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            context_key BLOB NOT NULL,
+            input TEXT NOT NULL,
+            embedding BLOB,
+            response TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+
     # Enhanced butler prompt
     enhanced_prompt = """You are Elfrid, a highly sophisticated AI butler with a formal yet warm demeanor. Your purpose is to serve with exceptional attention to detail and anticipate needs before they are expressed. Consider yourself the digital equivalent of a professional household manager.
 
@@ -87,109 +338,162 @@ When responding to requests:
 
     cursor.execute('SELECT COUNT(*) FROM config')
     if cursor.fetchone()[0] == 0:
+        cursor.execute('INSERT INTO config (elfrid_prompt) VALUES (?)', (enhanced_prompt,))
+
+    conn.commit()
+
+# users columns holding each user's modes and memory table names pre-encoded as JSON, as
+# (users column, source table, source columns it depends on, query building the JSON),
+# where {ref} is the trigger row (NEW or OLD) whose user is being refreshed
+_USER_JSON_COLUMNS = [
+    ("modes_json", "modes", "user_id, mode_name, mode_data", """
+        SELECT json_group_array(json_object('mode_name', mode_name, 'mode_data', mode_data))
+        FROM (SELECT mode_name, mode_data FROM modes WHERE user_id = {ref}.user_id ORDER BY mode_id)
+    """),
+    ("memory_tables_json", "memory", "user_id, table_name", """
+        SELECT json_group_array(table_name)
+        FROM (SELECT table_name FROM memory WHERE user_id = {ref}.user_id ORDER BY memory_id)
+    """),
+]
+
+def _create_user_json_columns(cursor):
+    """
+    Add the materialized JSON columns to users and the triggers that keep them current.
+    The triggers run inside whichever transaction touches modes or memory, so every
+    write path (including the LLM's generic insert/update tools) refreshes them.
+    Updates only refresh when a column the JSON depends on changes, and only refresh
+    the previous owner too when a row moves between users.
+    """
+    existing = {row[1] for row in cursor.execute("PRAGMA table_info(users)")}
+    for column, table, source_columns, query in _USER_JSON_COLUMNS:
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE users ADD COLUMN {column} TEXT NOT NULL DEFAULT '[]'")
+            cursor.execute(f"UPDATE users SET {column} = ({query.format(ref='users')})")
+        
+        refresh_new = f"UPDATE users SET {column} = ({query.format(ref='NEW')}) WHERE user_id = NEW.user_id;"
+        refresh_old = f"UPDATE users SET {column} = ({query.format(ref='OLD')}) WHERE user_id = OLD.user_id;"
+        refresh_moved = f"UPDATE users SET {column} = ({query.format(ref='OLD')}) WHERE user_id = OLD.user_id AND OLD.user_id IS NOT NEW.user_id;"
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_json_insert AFTER INSERT ON {table} BEGIN {refresh_new} END")
         cursor.execute(
-            'INSERT INTO config (elfrid_prompt, created_at) VALUES (?, ?)',
-            (enhanced_prompt, datetime.now())
+            f"CREATE TRIGGER IF NOT EXISTS {table}_json_update AFTER UPDATE OF {source_columns} ON {table} "
+            f"BEGIN {refresh_moved} {refresh_new} END"
         )
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_json_delete AFTER DELETE ON {table} BEGIN {refresh_old} END")
 
-    conn.commit()
-    conn.close()
-
-def get_db():
-    """Get a database connection to 'elfrid.db'."""
-    conn = sqlite3.connect('backend/elfrid.db')
-    conn.row_factory = sqlite3.Row
-    conn.execute('PRAGMA foreign_keys = ON')
-    return conn
-
-def close_db(conn):
-    """Close the database connection."""
-    conn.close()
-
-def validate_user(user_id):
-    """Validate that user_id exists in users table."""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM users WHERE user_id = ?", (user_id,))
-    count = cursor.fetchone()[0]
-    close_db(conn)
-    
-    if count == 0:
-        raise ValueError(f"User ID {user_id} not found")
-    return True
+def _load_schema():
+    """Return the cached table schemas, reading sqlite_master only when the cache is stale."""
+    global _schema_cache
+    with _schema_lock:
+        if _schema_cache is None:
+            with acquire() as conn:
+                cursor = conn.cursor()
+                cursor.execute(_SQL_TABLE_SCHEMAS)
+                _schema_cache = {row["name"]: row["sql"] for row in cursor.fetchall()}
+        return _schema_cache
+
+def _invalidate_schema():
+    """Drop the cached schemas after a table is created."""
+    global _schema_cache
+    with _schema_lock:
+        _schema_cache = None
 
 def create_table(table_name, schema):
     """Create a custom table dynamically based on LLM's decision."""
-    if not all(c.isalnum() or c == '_' for c in table_name):
+    if not _VALID_IDENT(table_name):
         raise ValueError(f"Invalid table name: {table_name}")
     
     # Security check for schema
     if ";" in schema and not schema.strip().endswith(";"):
         raise ValueError("Invalid schema: multiple SQL statements not allowed")
     
-    conn = get_db()
-    cursor = conn.cursor()
+    with acquire() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute(schema)
+        except sqlite3.Error as e:
+            raise ValueError(f"Failed to create table: {e}")
     
-    try:
-        cursor.execute(schema)
-        conn.commit()
-        close_db(conn)
-        return f"Table '{table_name}' created successfully"
-    except sqlite3.Error as e:
-        close_db(conn)
-        raise ValueError(f"Failed to create table: {e}")
+    _invalidate_schema()
+    return f"Table '{table_name}' created successfully"
 
 def execute_custom_query(query, params=None):
-    """Execute a custom SQL query (read-only for safety)."""
+    """
+    Execute a custom SQL query (read-only for safety).
+    Returns:
+        {"columns": [...], "rows": [tuple, ...]} - column names once, then plain value tuples.
+        BLOB values come back as a "<blob N bytes>" placeholder; the result is shown to
+        the model, and raw bytes (such as stored embeddings) would flood its context.
+    """
     # Security check - ensure it's a SELECT query
-    if not query.strip().lower().startswith("select"):
+    if not _SELECT_RE.match(query):
         raise ValueError("Only SELECT queries are allowed through this method")
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    try:
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
+    with acquire() as conn:
+        cursor = conn.cursor()
+        # Plain tuples: no per-row Row or dict objects for large results
+        cursor.row_factory = _blob_placeholder_row
+        
+        try:
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
             
-        results = [dict(row) for row in cursor.fetchall()]
-        close_db(conn)
-        return results
-    except sqlite3.Error as e:
-        close_db(conn)
-        raise ValueError(f"Query execution failed: {e}")
+            columns = [column[0] for column in cursor.description]
+            return {"columns": columns, "rows": cursor.fetchall()}
+        except sqlite3.Error as e:
+            raise ValueError(f"Query execution failed: {e}")
+
+def _blob_placeholder_row(cursor, row):
+    """Row factory returning the row as a tuple with each BLOB replaced by its size."""
+    if any(type(value) is bytes for value in row):
+        return tuple(f"<blob {len(value)} bytes>" if type(value) is bytes else value for value in row)
+    return row
+
+def _check_columns(columns):
+    """Raise ValueError unless every column name is a plain identifier."""
+    for column in columns:
+        if not _VALID_IDENT(column):
+            raise ValueError(f"Invalid column name: {column}")
+
+@functools.lru_cache(maxsize=256)
+def _insert_sql(table_name, columns):
+    """Build the INSERT for a table and column tuple; repeated shapes reuse one string and prepared statement."""
+    _check_columns(columns)
+    return f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+
+@functools.lru_cache(maxsize=256)
+def _update_sql(table_name, set_columns, where_columns):
+    """Build the UPDATE for a table, SET column tuple and WHERE column tuple."""
+    _check_columns(set_columns + where_columns)
+    set_clause = ", ".join([f"{col} = ?" for col in set_columns])
+    where_clause = " AND ".join([f"{col} = ?" for col in where_columns])
+    return f"UPDATE {table_name} SET {set_clause} WHERE {where_clause}"
 
 def insert_data(table_name, data_dict):
     """Insert data into any table."""
-    if not all(c.isalnum() or c == '_' for c in table_name):
+    if not _VALID_IDENT(table_name):
         raise ValueError(f"Invalid table name: {table_name}")
     
     if not isinstance(data_dict, dict) or not data_dict:
         raise ValueError("Data must be a non-empty dictionary")
     
-    columns = list(data_dict.keys())
-    values = list(data_dict.values())
-    placeholders = ", ".join(["?"] * len(values))
-    
-    conn = get_db()
-    cursor = conn.cursor()
+    query = _insert_sql(table_name, tuple(data_dict))
     
-    try:
-        query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
-        cursor.execute(query, values)
-        row_id = cursor.lastrowid
-        conn.commit()
-        close_db(conn)
-        return f"Data inserted into '{table_name}' with ID {row_id}"
-    except sqlite3.Error as e:
-        close_db(conn)
-        raise ValueError(f"Failed to insert data: {e}")
+    with acquire() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute(query, list(data_dict.values()))
+            row_id = cursor.lastrowid
+            return f"Data inserted into '{table_name}' with ID {row_id}"
+        except sqlite3.Error as e:
+            raise ValueError(f"Failed to insert data: {e}")
 
 def update_data(table_name, condition_dict, data_dict):
     """Update data in any table."""
-    if not all(c.isalnum() or c == '_' for c in table_name):
+    if not _VALID_IDENT(table_name):
         raise ValueError(f"Invalid table name: {table_name}")
     
     if not isinstance(data_dict, dict) or not data_dict:
@@ -198,214 +502,243 @@ def update_data(table_name, condition_dict, data_dict):
     if not isinstance(condition_dict, dict) or not condition_dict:
         raise ValueError("Condition must be a non-empty dictionary")
     
-    set_clause = ", ".join([f"{col} = ?" for col in data_dict.keys()])
-    where_clause = " AND ".join([f"{col} = ?" for col in condition_dict.keys()])
-    
+    query = _update_sql(table_name, tuple(data_dict), tuple(condition_dict))
     params = list(data_dict.values()) + list(condition_dict.values())
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    try:
-        query = f"UPDATE {table_name} SET {set_clause} WHERE {where_clause}"
-        cursor.execute(query, params)
-        affected_rows = cursor.rowcount
-        conn.commit()
-        close_db(conn)
-        return f"Updated {affected_rows} rows in '{table_name}'"
-    except sqlite3.Error as e:
-        close_db(conn)
-        raise ValueError(f"Failed to update data: {e}")
+    with acquire() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute(query, params)
+            affected_rows = cursor.rowcount
+            return f"Updated {affected_rows} rows in '{table_name}'"
+        except sqlite3.Error as e:
+            raise ValueError(f"Failed to update data: {e}")
 
 def list_tables():
     """List all tables in the database."""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-    tables = [row["name"] for row in cursor.fetchall()]
-    
-    close_db(conn)
-    return tables
+    return list(_load_schema())
 
 def get_schema(table_name=None):
     """Get schema information for database tables."""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    schemas = {}
+    if table_name and not _VALID_IDENT(table_name):
+        raise ValueError(f"Invalid table name: {table_name}")
     
+    schemas = _load_schema()
     if table_name:
-        if not all(c.isalnum() or c == '_' for c in table_name):
-            close_db(conn)
-            raise ValueError(f"Invalid table name: {table_name}")
-            
-        cursor.execute(f"SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-        result = cursor.fetchone()
-        if result:
-            schemas[table_name] = result["sql"]
-    else:
-        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table'")
-        for row in cursor.fetchall():
-            schemas[row["name"]] = row["sql"]
-    
-    close_db(conn)
-    return schemas
+        return {table_name: schemas[table_name]} if table_name in schemas else {}
+    return dict(schemas)
 
 def new_session(user_id):
     """Create a new chat session for the user."""
-    validate_user(user_id)
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    timestamp = datetime.now()
-    
-    cursor.execute(
-        "INSERT INTO sessions (user_id, chat_state, timestamp) VALUES (?, ?, ?)",
-        (user_id, '{}', timestamp)
-    )
-    conn.commit()
-    
-    session_id = cursor.lastrowid
-    close_db(conn)
-    
-    return session_id
+    with acquire() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            # fetchall runs the statement to completion, which is what commits it
+            session_id = cursor.execute(_SQL_INSERT_SESSION, (user_id, '{}')).fetchall()[0][0]
+        except sqlite3.IntegrityError:
+            # The foreign key on sessions.user_id doubles as the user check
+            raise ValueError(f"User ID {user_id} not found")
+        
+        return session_id
 
 def get_context(user_id):
-    """Fetch context for a user request."""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT elfrid_prompt FROM config LIMIT 1")
-    elfrid_prompt = cursor.fetchone()["elfrid_prompt"]
-    
-    cursor.execute("SELECT world_model FROM users WHERE user_id = ?", (user_id,))
-    world_model = cursor.fetchone()["world_model"]
-    
-    cursor.execute("SELECT mode_name, mode_data FROM modes WHERE user_id = ?", (user_id,))
-    modes_rows = cursor.fetchall()
-    modes_array = [{"mode_name": row["mode_name"], "mode_data": row["mode_data"]} for row in modes_rows]
+    """
+    Fetch context for a user request, raising ValueError if the user does not exist.
+    Modes and memory table names come back as the JSON strings kept on the users row;
+    has_history is True once the session has logged turns.
+    """
+    # One round trip for the user row and their latest session
+    with acquire() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(_SQL_CONTEXT, (user_id, user_id))
+        rows = cursor.fetchall()
+        elfrid_prompt = _get_elfrid_prompt(cursor)
+    
+    world_model = modes_json = memory_tables_json = session_row = None
+    for kind, v1, v2, v3 in rows:
+        if kind == 'user':
+            world_model, modes_json, memory_tables_json = v1, v2, v3
+        else:
+            session_row = (v1, v2, bool(v3))
     
-    cursor.execute("SELECT DISTINCT table_name FROM memory WHERE user_id = ?", (user_id,))
-    memory_tables = [row["table_name"] for row in cursor.fetchall()]
+    if world_model is None:
+        raise ValueError(f"User ID {user_id} not found")
     
-    # Add all database tables to provide full context
     db_tables = list_tables()
     
-    cursor.execute(
-        "SELECT session_id, chat_state FROM sessions WHERE user_id = ? ORDER BY timestamp DESC LIMIT 1",
-        (user_id,)
-    )
-    session_row = cursor.fetchone()
-    
     if session_row:
-        session_id = session_row["session_id"]
-        chat_state = session_row["chat_state"]
+        session_id, chat_state, has_history = session_row
     else:
         session_id = new_session(user_id)
         chat_state = '{}'
+        has_history = False
     
-    close_db(conn)
-    
-    return elfrid_prompt, world_model, modes_array, memory_tables, db_tables, session_id, chat_state
+    return elfrid_prompt, world_model, modes_json, memory_tables_json, db_tables, session_id, chat_state, has_history
 
-def get_session_logs(session_id):
-    """Fetch all logs for a given session_id."""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "SELECT request, response FROM logs WHERE session_id = ? ORDER BY timestamp",
-        (session_id,)
-    )
-    logs = [{"request": row["request"], "response": row["response"]} for row in cursor.fetchall()]
-    
-    close_db(conn)
-    return logs
+def get_session_logs(session_id, limit=None):
+    """Fetch the logs for a given session_id in order, or only the latest `limit` of them."""
+    with acquire() as conn:
+        # Hot read: plain tuples skip the by-name lookups of sqlite3.Row
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(_SQL_SESSION_LOGS, (session_id, -1 if limit is None else limit))
+        return [{"request": request, "response": response} for request, response in cursor.fetchall()]
 
-def execute_query(user_id, action, table_name, data=None):
-    """Execute a query on the memory table."""
-    validate_user(user_id)
-    conn = get_db()
-    cursor = conn.cursor()
-    
+def get_relevant_logs(session_id, embedding, limit, recent=0, window=None):
+    """
+    Fetch the `limit` logs of a session most similar to a float16 query embedding,
+    plus the latest `recent` logs, in chronological order.
+    Only the latest `window` logs are considered, so the scan stays bounded as the session grows.
+    """
+    with acquire() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(_SQL_RELEVANT_LOGS, (session_id, -1 if window is None else window, embedding, limit))
+        rows = {log_id: (request, response) for log_id, request, response in cursor.fetchall()}
+        if recent:
+            cursor.execute(_SQL_RECENT_LOGS, (session_id, recent))
+            rows.update((log_id, (request, response)) for log_id, request, response in cursor.fetchall())
+    
+    return [{"request": request, "response": response} for _, (request, response) in sorted(rows.items())]
+
+def execute_query(user_id, action, table_name, data=None, conn=None):
+    """Execute a query on the memory table; updates join conn's transaction when given."""
     if action == "read":
-        cursor.execute(
-            "SELECT data FROM memory WHERE user_id = ? AND table_name = ? LIMIT 1",
-            (user_id, table_name)
-        )
-        row = cursor.fetchone()
-        close_db(conn)
-        return row["data"] if row else None
+        return read_memories(user_id, [table_name]).get(table_name)
     elif action == "update":
         if not data:
-            close_db(conn)
             raise ValueError("Data required for update action")
-        try:
-            json.loads(data)  # Validate JSON
-            cursor.execute(
-                "SELECT memory_id FROM memory WHERE user_id = ? AND table_name = ?",
-                (user_id, table_name)
-            )
-            row = cursor.fetchone()
-            timestamp = datetime.now()
-            if row:
-                cursor.execute(
-                    "UPDATE memory SET data = ?, last_updated = ? WHERE memory_id = ?",
-                    (data, timestamp, row["memory_id"])
-                )
-            else:
-                cursor.execute(
-                    "INSERT INTO memory (user_id, table_name, data, last_updated) VALUES (?, ?, ?, ?)",
-                    (user_id, table_name, data, timestamp)
-                )
-            conn.commit()
-        except json.JSONDecodeError:
-            close_db(conn)
-            raise ValueError("Invalid JSON data for update")
-        close_db(conn)
+        check_memory_data(table_name, data)
+        update_memories(user_id, [(table_name, data)], conn=conn)
         return None
     else:
-        close_db(conn)
         raise ValueError("Invalid action: must be 'read' or 'update'")
 
-def update_mode(user_id, mode_name, new_data):
+# JSON Schemas for the data of particular memory tables, e.g. {"schedule": {"type": "array"}}.
+# Tables without one only need well-formed JSON
+MEMORY_SCHEMAS = {}
+
+# table_name -> (schema, compiled validator); recompiled when the registered schema changes
+_memory_validators = {}
+
+def _memory_validator(table_name):
+    """
+    Return the compiled validator for a memory table's schema, or None if it has none.
+    Only schemas are cached, so one registered after the table's first write still applies.
+    """
+    schema = MEMORY_SCHEMAS.get(table_name)
+    if schema is None:
+        return None
+    cached = _memory_validators.get(table_name)
+    if cached is None or cached[0] is not schema:
+        # Only needed once a schema is registered; generates a specialized checker per schema
+        import fastjsonschema
+        cached = (schema, fastjsonschema.compile(schema))
+        _memory_validators[table_name] = cached
+    return cached[1]
+
+def check_memory_data(table_name, data):
+    """Raise ValueError unless data is JSON that fits the memory table's schema, if it has one."""
+    try:
+        value = orjson.loads(data)
+    except orjson.JSONDecodeError:
+        raise ValueError("Invalid JSON data for update")
+    validator = _memory_validator(table_name)
+    if validator is not None:
+        try:
+            validator(value)
+        except ValueError as e:  # fastjsonschema.JsonSchemaException
+            raise ValueError(f"Invalid data for {table_name}: {e}")
+
+def _placeholders(count):
+    """Return the '?, ?, ...' list for an IN clause of count values."""
+    return ", ".join(["?"] * count)
+
+@functools.lru_cache(maxsize=64)
+def _in_list_sql(template, count):
+    """Fill a query template's IN list for count values; each count reuses one string and prepared statement."""
+    return template.format(_placeholders(count))
+
+def read_memories(user_id, table_names):
+    """Fetch several of a user's memory tables in one query, as {table_name: data}."""
+    # No user check here: get_context has already checked the user for this request,
+    # and an unknown user simply has no memory rows
+    with acquire() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        # The unique (user_id, table_name) index allows at most one row per name
+        cursor.execute(_in_list_sql(_SQL_READ_MEMORIES, len(table_names)), (user_id, *table_names))
+        return dict(cursor.fetchall())
+
+def update_memories(user_id, rows, conn=None):
+    """
+    Create or replace several (table_name, data) memory entries for a user in one transaction,
+    or in conn's when given. Data must already be validated JSON; when a name repeats, the last entry wins.
+    """
+    with _writing(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(_SQL_UPSERT_MEMORY, [(user_id, table_name, data) for table_name, data in rows])
+        except sqlite3.IntegrityError:
+            # Only the insert branch can fail, and only on the foreign key to users
+            raise ValueError(f"User ID {user_id} not found")
+
+def get_modes_data(user_id, mode_names):
+    """Fetch the stored data for several of a user's modes in one query, as {mode_name: mode_data}."""
+    with acquire() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(_in_list_sql(_SQL_READ_MODES, len(mode_names)), (user_id, *mode_names))
+        return dict(cursor.fetchall())
+
+def update_mode(user_id, mode_name, new_data, conn=None):
     """Update or insert data in the modes table for a user."""
-    validate_user(user_id)
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "SELECT mode_id FROM modes WHERE user_id = ? AND mode_name = ?",
-        (user_id, mode_name)
-    )
-    row = cursor.fetchone()
-    
-    timestamp = datetime.now()
-    if row:
-        cursor.execute(
-            "UPDATE modes SET mode_data = ?, last_updated = ? WHERE mode_id = ?",
-            (new_data, timestamp, row["mode_id"])
-        )
-    else:
-        cursor.execute(
-            "INSERT INTO modes (user_id, mode_name, mode_data, last_updated) VALUES (?, ?, ?, ?)",
-            (user_id, mode_name, new_data, timestamp)
-        )
-    
-    conn.commit()
-    close_db(conn)
+    update_modes(user_id, [(mode_name, new_data)], conn=conn)
+
+def update_modes(user_id, rows, conn=None):
+    """Update or insert several (mode_name, mode_data) rows for a user in one transaction, or conn's; the last entry per name wins."""
+    with _writing(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(_SQL_UPSERT_MODE, [(user_id, mode_name, data) for mode_name, data in rows])
+        except sqlite3.IntegrityError:
+            # Only the insert branch can fail, and only on the foreign key to users
+            raise ValueError(f"User ID {user_id} not found")
 
-def log_interaction(user_id, session_id, request_text, response_text):
+def log_interaction(user_id, session_id, request_text, response_text, embedding=None, conn=None):
     """Log a request-response pair to the logs table."""
-    conn = get_db()
-    cursor = conn.cursor()
-    timestamp = datetime.now()
-    
-    cursor.execute(
-        "INSERT INTO logs (user_id, session_id, request, response, timestamp) VALUES (?, ?, ?, ?, ?)",
-        (user_id, session_id, request_text, response_text, timestamp)
-    )
-    conn.commit()
-    close_db(conn)
\ No newline at end of file
+    log_interactions([(user_id, session_id, request_text, response_text, embedding)], conn=conn)
+
+def log_interactions(rows, conn=None):
+    """
+    Log a batch of (user_id, session_id, request, response, embedding) rows in one transaction,
+    or conn's, and return their log ids in order.
+    """
+    with _writing(conn) as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        return [cursor.execute(_SQL_INSERT_LOGS, row).fetchall()[0][0] for row in rows]
+
+def set_log_embeddings(rows):
+    """Fill in the embeddings of logged interactions from (embedding, log_id) rows."""
+    with _writing() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(_SQL_SET_LOG_EMBEDDING, rows)
+
+def save_cached_response(cache_key, user_id, context_key, input_text, embedding, response_text):
+    """Persist a cached LLM response."""
+    with acquire() as conn:
+        cursor = conn.cursor()
+        cursor.execute(_SQL_SAVE_CACHED_RESPONSE, (cache_key, user_id, context_key, input_text, embedding, response_text))
+
+def load_cached_responses(limit):
+    """Fetch the most recent cached responses, oldest first."""
+    with acquire() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(_SQL_LOAD_CACHED_RESPONSES, (limit,))
+        rows = cursor.fetchall()
+    return rows[::-1]
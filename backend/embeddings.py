@@ -0,0 +1,86 @@
+import asyncio
+import numpy as np
+from gemini import get_genai
+
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+EMBEDDING_DIMENSIONS = 768
+
+async def embed_texts(texts):
+    """
+    Embed a batch of texts with a single Gemini call.
+    Returns:
+        float32 array of shape (len(texts), EMBEDDING_DIMENSIONS) with unit-length rows,
+        so a dot product between rows is their cosine similarity.
+    """
+    result = await get_genai().embed_content_async(
+        model=EMBEDDING_MODEL,
+        content=list(texts),
+        output_dimensionality=EMBEDDING_DIMENSIONS
+    )
+    vectors = np.asarray(result["embedding"], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def to_blob(vector, dtype=np.float32):
+    """Serialize an embedding for storage in SQLite."""
+    return np.asarray(vector, dtype=dtype).tobytes()
+
+def from_blob(blob, dtype=np.float32):
+    """Deserialize an embedding stored with to_blob."""
+    return np.frombuffer(blob, dtype=dtype)
+
+class EmbeddingBatcher:
+    """
+    Micro-batches concurrent embedding requests.
+    Texts submitted within max_wait seconds of each other (up to max_batch) are
+    embedded with one batched Gemini call and each caller gets its own row back.
+    """
+
+    def __init__(self, max_wait=0.02, max_batch=100):
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self._queue = None
+        self._worker = None
+
+    async def submit(self, text):
+        """Embed a single text as part of the next batch."""
+        if self._worker is None:
+            # Created lazily so both belong to the running event loop
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+
+    async def _run(self):
+        """Collect pending texts into batches and resolve their futures."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                vectors = await embed_texts([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+_batcher = EmbeddingBatcher()
+
+async def embed_text(text):
+    """Embed one text, sharing a Gemini call with any concurrent requests."""
+    return await _batcher.submit(text)
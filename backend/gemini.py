@@ -0,0 +1,18 @@
+import functools
+import os
+
+@functools.lru_cache(maxsize=None)
+def get_genai():
+    """
+    Import and configure the Gemini SDK on first use.
+    It is by far the slowest import in the backend, so it is kept off the startup path.
+    """
+    import google.generativeai as genai
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai
+
+@functools.lru_cache(maxsize=None)
+def transient_errors():
+    """Errors worth retrying: the request itself was fine, Gemini was busy."""
+    from google.api_core import exceptions
+    return (exceptions.ResourceExhausted, exceptions.ServiceUnavailable)
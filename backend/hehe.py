@@ -1,93 +1,145 @@
+import asyncio
 import os
-import requests
-import json
-from datetime import datetime
+import aiohttp
+import orjson
 from dotenv import load_dotenv
 from pathlib import Path
 import db
+from prompt_toolkit import PromptSession
+from prompt_toolkit.formatted_text import FormattedText
 from rich.console import Console
+from rich.live import Live
 from rich.panel import Panel
-from rich.prompt import Prompt
-import time
+from rich.style import Style
+from rich.text import Text
 
 # Initialize Rich Console
 console = Console()
 
+# Styling for the per-turn renders, built once instead of parsing markup on every chunk
+PROMPT = FormattedText([("bold ansicyan", "> ")])
+ELFRID_TITLE = Text("Elfrid", style="bold magenta")
+ELFRID_BORDER = Style(color="magenta")
+
 # Load environment variables
 env_path = Path(__file__).resolve().parent.parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
 BASE_URL = "http://localhost:5000"
-
-def check_server_connection(url, retries=3, delay=2):
+JSON_HEADERS = {"Content-Type": "application/json"}
+STREAM_HEADERS = {**JSON_HEADERS, "Accept": "text/event-stream"}
+
+def open_http():
+    """
+    Open the one keep-alive HTTP session every call goes through, so chat turns
+    reuse the same socket. Must be called from inside the running event loop.
+    """
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=4))
+
+def post_json(http, url, payload, timeout, headers=JSON_HEADERS):
+    """POST a payload encoded with orjson; use the result as an async context manager."""
+    return http.post(url, data=orjson.dumps(payload), headers=headers, timeout=timeout)
+
+async def read_events(response):
+    """Yield (event, data) pairs from a Server-Sent Events response as they arrive."""
+    event, data = "message", []
+    async for raw_line in response.content:
+        line = raw_line.decode("utf-8").rstrip("\r\n")
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            data.append(line[len("data: "):])
+        elif not line and data:
+            yield event, "\n".join(data)
+            event, data = "message", []
+
+def elfrid_panel(text):
+    """Panel for Elfrid's reply."""
+    # Text rather than str: the reply is shown verbatim, not parsed as markup
+    return Panel(Text(text.strip()), title=ELFRID_TITLE, border_style=ELFRID_BORDER)
+
+async def check_server_connection(http, url, retries=3, delay=2):
     """Check if the Flask server is running."""
     console.print(f"Checking connection to [cyan]{url}[/]...")
     health_url = url.rstrip('/') + "/health" # Ensure correct URL formation
     for i in range(retries):
         try:
-            response = requests.get(health_url, timeout=2) # Check the /health endpoint
-            response.raise_for_status() # Raise an exception for bad status codes
-            if response.json().get("status") == "ok":
+            async with http.get(health_url, timeout=aiohttp.ClientTimeout(total=2)) as response: # Check the /health endpoint
+                response.raise_for_status() # Raise an exception for bad status codes
+                body = orjson.loads(await response.read())
+            if body.get("status") == "ok":
                  console.print("[green]Server connection successful![/]")
                  return True
             else:
                  console.print(f"[yellow]Connection attempt {i+1}/{retries} failed. Server responded but status not ok. Retrying in {delay}s...[/]")
-                 time.sleep(delay)
+                 await asyncio.sleep(delay)
 
-        except requests.exceptions.ConnectionError:
+        except aiohttp.ClientConnectionError:
             console.print(f"[yellow]Connection attempt {i+1}/{retries} failed. Server not reachable. Retrying in {delay}s...[/]")
-            time.sleep(delay)
-        except requests.exceptions.Timeout:
+            await asyncio.sleep(delay)
+        except asyncio.TimeoutError:
             console.print(f"[yellow]Connection attempt {i+1}/{retries} timed out. Retrying in {delay}s...[/]")
-            time.sleep(delay)
-        except requests.exceptions.RequestException as e:
+            await asyncio.sleep(delay)
+        except aiohttp.ClientError as e:
             console.print(f"[red]An error occurred during connection check: {e}[/]")
             return False # Non-recoverable error
     console.print("[red]Server connection failed after multiple attempts.[/]")
     return False
 
-def create_session():
+async def create_session(http):
     """Create a new chat session for user_id=1."""
     url = f"{BASE_URL}/new_chat"
     payload = {"user_id": 1}
     console.print("Creating new session...")
     try:
-        response = requests.post(url, json=payload, timeout=10) # Increased timeout
-        if response.status_code == 200:
-            data = response.json()
-            console.print(f"[green]New session created: session_id={data['session_id']}[/]")
-            return data["session_id"]
-        else:
-            console.print(f"[red]Error creating session: Status {response.status_code}, {response.text}[/]")
-            return None
-    except requests.RequestException as e:
+        async with post_json(http, url, payload, timeout=aiohttp.ClientTimeout(total=10)) as response: # Increased timeout
+            if response.status == 200:
+                data = orjson.loads(await response.read())
+                console.print(f"[green]New session created: session_id={data['session_id']}[/]")
+                return data["session_id"]
+            else:
+                console.print(f"[red]Error creating session: Status {response.status}, {await response.text()}[/]")
+                return None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         console.print(f"[red]Error sending request to create session: {e}[/]")
         return None
 
-def chat_loop(session_id):
+async def chat_loop(http, session_id):
     """Run an interactive chat loop with the /voice endpoint using Rich."""
     url = f"{BASE_URL}/voice"
     console.print("\n[bold blue]Chat with Elfrid[/] (type '[italic red]quit[/]' to exit):")
+    prompt_session = PromptSession()
+    # Streamed, so the timeout bounds the wait for each chunk rather than the whole reply
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
 
     while True:
         try:
-            user_input = Prompt.ask("[bold cyan]> [/]")
+            user_input = await prompt_session.prompt_async(PROMPT)
             if user_input.lower() == 'quit':
                 break
 
             payload = {"user_id": 1, "input": user_input}
             try:
-                response = requests.post(url, json=payload, timeout=30) # Increased timeout for potentially long LLM calls
-                # console.print(f"Status Code: {response.status_code}") # Optional: for debugging
-                if response.status_code == 200:
-                    data = response.json()
-                    # Use Panel for Elfrid's response
-                    console.print(Panel(data['response'].strip(), title="[bold magenta]Elfrid[/]", border_style="magenta"))
-                else:
-                    console.print(Panel(f"Error: {response.text}", title="[bold red]Error[/]", border_style="red"))
-            except requests.exceptions.Timeout:
+                async with post_json(http, url, payload, timeout=timeout, headers=STREAM_HEADERS) as response:
+                    # console.print(f"Status Code: {response.status}") # Optional: for debugging
+                    if response.status == 200:
+                        reply, error = "", None
+                        # Grow Elfrid's panel in place as the reply is generated
+                        with Live(elfrid_panel(reply), console=console, refresh_per_second=15) as live:
+                            # Read to the end of the stream so the connection goes back to the pool
+                            async for event, data in read_events(response):
+                                if event == "error":
+                                    error = data
+                                elif event != "done":
+                                    reply += data
+                                    live.update(elfrid_panel(reply))
+                        if error:
+                            console.print(Panel(f"Error: {error}", title="[bold red]Error[/]", border_style="red"))
+                    else:
+                        console.print(Panel(f"Error: {await response.text()}", title="[bold red]Error[/]", border_style="red"))
+            except asyncio.TimeoutError:
                  console.print(Panel("Request timed out. The server might be busy.", title="[bold red]Timeout[/]", border_style="red"))
-            except requests.RequestException as e:
+            except aiohttp.ClientError as e:
                 console.print(Panel(f"Error sending request: {e}", title="[bold red]Request Error[/]", border_style="red"))
 
         except EOFError: # Handle Ctrl+D
@@ -100,18 +152,33 @@ def chat_loop(session_id):
 def cleanup_database():
     """Clean up test data from the database."""
     console.print("\nCleaning up test data...")
-    conn = db.get_db()
-    cursor = conn.cursor()
+    with db.transaction() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("DELETE FROM logs WHERE user_id = ?", (1,))
+        cursor.execute("DELETE FROM response_cache WHERE user_id = ?", (1,))
+        cursor.execute("DELETE FROM sessions WHERE user_id = ?", (1,))
+        cursor.execute("DELETE FROM memory WHERE user_id = ?", (1,))
+        cursor.execute("DELETE FROM modes WHERE user_id = ?", (1,))
+        cursor.execute("DELETE FROM users WHERE user_id = ?", (1,))
+    console.print("[green]Test data cleaned up.[/]")
 
-    cursor.execute("DELETE FROM logs WHERE user_id = ?", (1,))
-    cursor.execute("DELETE FROM sessions WHERE user_id = ?", (1,))
-    cursor.execute("DELETE FROM memory WHERE user_id = ?", (1,))
-    cursor.execute("DELETE FROM modes WHERE user_id = ?", (1,))
-    cursor.execute("DELETE FROM users WHERE user_id = ?", (1,))
+async def run():
+    """Connect to the server and chat until the user quits."""
+    async with open_http() as http:
+        # Check server connection first
+        if not await check_server_connection(http, BASE_URL):
+            console.print("[bold red]Exiting:[/][yellow] Cannot connect to the backend server.[/]")
+            exit(1)
 
-    conn.commit()
-    db.close_db(conn)
-    console.print("[green]Test data cleaned up.[/]")
+        # No database initialization here - app.py already does this
+
+        session_id = await create_session(http)
+        if session_id:
+            await chat_loop(http, session_id)
+            # Don't clean up data to ensure persistence
+        else:
+            console.print("[red]Failed to start chat session.[/]")
 
 def main():
     """Run the interactive chat loop."""
@@ -123,21 +190,9 @@ def main():
         console.print("[bold red]Error:[/][yellow] GEMINI_API_KEY not set in .env[/]")
         exit(1)
 
-    # Check server connection first
-    if not check_server_connection(BASE_URL):
-        console.print("[bold red]Exiting:[/][yellow] Cannot connect to the backend server.[/]")
-        exit(1)
-
-    # No database initialization here - app.py already does this
-    
-    session_id = create_session()
-    if session_id:
-        chat_loop(session_id)
-        # Don't clean up data to ensure persistence
-    else:
-        console.print("[red]Failed to start chat session.[/]")
+    asyncio.run(run())
 
     console.print("[bold blue]Chat session ended.[/]")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
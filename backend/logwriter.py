@@ -0,0 +1,72 @@
+import asyncio
+import db
+import embeddings
+
+class LogWriter:
+    """
+    Write-behind queue for the logs table.
+    Interactions are queued without blocking the request and a single writer task
+    inserts everything that arrived within flush_interval seconds in one batch,
+    so the commit cost is paid once per batch instead of once per request.
+    The queue holds at most max_pending rows, so a stalled disk slows requests
+    down instead of growing memory without bound.
+    Once written, each batch is embedded with one Gemini call, bounded by
+    embed_timeout, and the embeddings are filled in afterwards so later requests can
+    retrieve the relevant turns; a slow embedding never delays the rows themselves.
+    """
+
+    def __init__(self, flush_interval=0.1, max_pending=1000, max_batch=200, embed_timeout=10):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.embed_timeout = embed_timeout
+        self._queue = None
+        self._writer = None
+        self._embed_tasks = set()
+
+    async def submit(self, user_id, session_id, request_text, response_text):
+        """Queue an interaction to be logged, waiting only if the queue is full."""
+        if self._writer is None:
+            # Created lazily so both belong to the running event loop
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._writer = asyncio.create_task(self._run())
+        await self._queue.put((user_id, session_id, request_text, response_text))
+
+    async def flush(self):
+        """Wait until every queued interaction has been written and embedded."""
+        if self._queue is not None:
+            await self._queue.join()
+        if self._embed_tasks:
+            await asyncio.gather(*self._embed_tasks)
+
+    async def _run(self):
+        """Drain the queue in batches for the lifetime of the event loop."""
+        while True:
+            rows = [await self._queue.get()]
+            await asyncio.sleep(self.flush_interval)
+            while len(rows) < self.max_batch and not self._queue.empty():
+                rows.append(self._queue.get_nowait())
+            try:
+                log_ids = await asyncio.to_thread(db.log_interactions, [(*row, None) for row in rows])
+            except Exception as e:
+                print(f"Error writing {len(rows)} interaction logs: {e}")
+                log_ids = None
+            for _ in rows:
+                self._queue.task_done()
+            if log_ids:
+                task = asyncio.create_task(self._embed(rows, log_ids))
+                self._embed_tasks.add(task)
+                task.add_done_callback(self._embed_tasks.discard)
+
+    async def _embed(self, rows, log_ids):
+        """Embed a written batch and store the vectors on its log rows."""
+        try:
+            vectors = await asyncio.wait_for(
+                embeddings.embed_texts([f"{row[2]}\n{row[3]}" for row in rows]), self.embed_timeout
+            )
+            blobs = [embeddings.to_blob(vector, db.LOG_EMBEDDING_DTYPE) for vector in vectors]
+            await asyncio.to_thread(db.set_log_embeddings, list(zip(blobs, log_ids)))
+        except asyncio.TimeoutError:
+            print(f"Timed out embedding {len(rows)} interaction logs after {self.embed_timeout}s")
+        except Exception as e:
+            print(f"Error embedding {len(rows)} interaction logs: {e}")